@@ -0,0 +1,73 @@
+"""
+Backfill rows written before the type-uploadedAt-index GSI.
+
+list_handler queries that index (partition key 'type', numeric sort key
+'uploadedAt'), so older rows are not listed until this has been run once:
+it sets type='image' and converts ISO-8601 'uploadedAt' strings to epoch
+milliseconds.
+
+Usage:
+    TABLE_NAME=<table> python scripts/backfill_image_type.py
+"""
+import boto3
+import os
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+dynamodb = boto3.resource('dynamodb')
+
+TABLE_NAME = os.environ['TABLE_NAME']
+
+
+def to_epoch_ms(uploaded_at):
+    """ISO-8601 timestamp (naive values are UTC) to epoch milliseconds"""
+    parsed = datetime.fromisoformat(uploaded_at)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def main():
+    table = dynamodb.Table(TABLE_NAME)
+    scan_args = {
+        'FilterExpression': 'attribute_not_exists(#type) OR attribute_type(uploadedAt, :string)',
+        'ProjectionExpression': 'imageId, uploadedAt',
+        'ExpressionAttributeNames': {'#type': 'type'},
+        'ExpressionAttributeValues': {':string': 'S'}
+    }
+    updated = 0
+    
+    while True:
+        response = table.scan(**scan_args)
+        
+        for item in response.get('Items', []):
+            update = 'SET #type = :type'
+            values = {':type': 'image'}
+            if isinstance(item.get('uploadedAt'), str):
+                update += ', uploadedAt = :uploaded_at'
+                values[':uploaded_at'] = to_epoch_ms(item['uploadedAt'])
+            
+            try:
+                table.update_item(
+                    Key={'imageId': item['imageId']},
+                    UpdateExpression=update,
+                    ConditionExpression='attribute_exists(imageId)',
+                    ExpressionAttributeNames={'#type': 'type'},
+                    ExpressionAttributeValues=values
+                )
+                updated += 1
+            except ClientError as e:
+                # Deleted since the scan page was read
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        scan_args['ExclusiveStartKey'] = last_key
+    
+    print(f"Backfilled {updated} items in {TABLE_NAME}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+from decimal import Decimal
+from botocore.config import Config
+
+# Shared by every handler; shipped alongside each one in its deployment zip
+
+try:
+    import orjson
+    
+    def json_dumps(obj, default=None):
+        return orjson.dumps(obj, default=default).decode()
+    
+    json_loads = orjson.loads
+except ImportError:  # orjson missing from the package; stdlib gives the same JSON, slower
+    import json
+    
+    def json_dumps(obj, default=None):
+        return json.dumps(obj, default=default, separators=(',', ':'))
+    
+    json_loads = json.loads
+
+# TCP keep-alive so pooled connections survive idle gaps between warm
+# invocations; retries stay at each service's default policy
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True
+)
+
+# Helper to convert Decimal to int/float for JSON serialization
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
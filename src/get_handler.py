@@ -1,24 +1,26 @@
-import json
 import boto3
+import logging
 import os
-from decimal import Decimal
+from common import BOTO_CONFIG, decimal_default, json_dumps
+from presign import get_download_url
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client('s3', config=BOTO_CONFIG)
+dynamodb = boto3.resource('dynamodb', config=BOTO_CONFIG)
+
+# Set LOG_LEVEL=DEBUG to log per-request details
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 BUCKET_NAME = os.environ['BUCKET_NAME']
 TABLE_NAME = os.environ['TABLE_NAME']
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return int(obj) if obj % 1 == 0 else float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# Resolved once per container instead of on every invocation
+_table = dynamodb.Table(TABLE_NAME)
 
 def lambda_handler(event, context):
     """
     GET /images/{id}
-    Get specific image metadata and generate presigned URL
+    Get specific image metadata and a download URL
     """
     try:
         # Get image ID from path parameters
@@ -31,14 +33,13 @@ def lambda_handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
+                'body': json_dumps({
                     'error': 'Missing image ID'
                 })
             }
         
         # Get metadata from DynamoDB
-        table = dynamodb.Table(TABLE_NAME)
-        response = table.get_item(
+        response = _table.get_item(
             Key={'imageId': image_id}
         )
         
@@ -49,27 +50,18 @@ def lambda_handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
+                'body': json_dumps({
                     'error': 'Image not found'
                 })
             }
         
         item = response['Item']
         
-        # Generate presigned URL (valid for 1 hour)
-        presigned_url = s3.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': BUCKET_NAME,
-                'Key': item['s3Key']
-            },
-            ExpiresIn=3600  # 1 hour
-        )
-        
-        # Add presigned URL to response
-        item['downloadUrl'] = presigned_url
+        # CDN link if CDN_DOMAIN is set, else a presigned URL (valid for 1 hour,
+        # cached across warm invocations)
+        item['downloadUrl'] = get_download_url(s3, BUCKET_NAME, item['s3Key'])
         
-        print(f"Retrieved image: {image_id}")
+        logger.debug("Retrieved image: %s", image_id)
         
         return {
             'statusCode': 200,
@@ -77,20 +69,20 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': json_dumps({
                 'image': item
-            }, cls=DecimalEncoder)
+            }, default=decimal_default)
         }
         
     except Exception as e:
-        print(f"Error getting image: {str(e)}")
+        logger.error("Error getting image: %s", e)
         return {
             'statusCode': 500,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': json_dumps({
                 'error': 'Internal server error',
                 'message': str(e)
             })
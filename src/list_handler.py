@@ -1,20 +1,75 @@
-import json
 import boto3
+import base64
+import logging
 import os
-from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from common import BOTO_CONFIG, decimal_default, json_dumps, json_loads
+from presign import get_download_url
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client('s3', config=BOTO_CONFIG)
+dynamodb = boto3.resource('dynamodb', config=BOTO_CONFIG)
+
+# Set LOG_LEVEL=DEBUG to log per-request details
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 BUCKET_NAME = os.environ['BUCKET_NAME']
 TABLE_NAME = os.environ['TABLE_NAME']
 
-# Helper to convert Decimal to int/float for JSON serialization
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return int(obj) if obj % 1 == 0 else float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# Resolved once per container instead of on every invocation
+_table = dynamodb.Table(TABLE_NAME)
+
+# GSI with partition key 'type' (S, always 'image') and sort key 'uploadedAt'
+# (N, epoch milliseconds). Older rows need scripts/backfill_image_type.py
+INDEX_NAME = 'type-uploadedAt-index'
+
+def generate_download_url(s3_key):
+    """Download URL (CDN or presigned) for s3_key, or None on failure"""
+    try:
+        return get_download_url(s3, BUCKET_NAME, s3_key)
+    except Exception as url_error:
+        logger.error("Error generating download URL for %s: %s", s3_key, url_error)
+        return None
+
+def fetch_page(limit, start_key=None):
+    """
+    Fetch one page of images, newest first, from the type-uploadedAt index.
+    Falls back to a table scan while the index has not been created yet.
+    """
+    query_args = {
+        'IndexName': INDEX_NAME,
+        'KeyConditionExpression': Key('type').eq('image'),
+        'ScanIndexForward': False,  # newest first
+        'Limit': limit
+    }
+    if start_key:
+        query_args['ExclusiveStartKey'] = start_key
+    
+    try:
+        return _table.query(**query_args)
+    except ClientError as e:
+        error = e.response['Error']
+        if error['Code'] != 'ValidationException' or 'specified index' not in error.get('Message', ''):
+            raise
+        logger.warning("Index %s not found, falling back to scan", INDEX_NAME)
+    
+    scan_args = {'Limit': limit}
+    if start_key:
+        scan_args['ExclusiveStartKey'] = start_key
+    return _table.scan(**scan_args)
+
+def invalid_token_response():
+    return {
+        'statusCode': 400,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json_dumps({
+            'error': 'Invalid nextToken'
+        })
+    }
 
 def lambda_handler(event, context):
     """
@@ -23,41 +78,55 @@ def lambda_handler(event, context):
     
     Optional query parameters:
     - limit: Number of items to return (default: 50)
+    - nextToken: Pagination token returned by the previous page
+    - includeUrls: Set to 1/true to add a downloadUrl to each image
     """
     try:
         # Get query parameters
         params = event.get('queryStringParameters') or {}
         limit = int(params.get('limit', 50))
         
-        # Query DynamoDB
-        table = dynamodb.Table(TABLE_NAME)
+        start_key = None
+        next_token = params.get('nextToken')
+        if next_token:
+            try:
+                start_key = json_loads(base64.urlsafe_b64decode(next_token))
+            except ValueError:
+                start_key = None
+            if not isinstance(start_key, dict) or not start_key:
+                return invalid_token_response()
         
-        response = table.scan(
-            Limit=limit
-        )
+        # Query DynamoDB
+        try:
+            response = fetch_page(limit, start_key)
+        except ClientError as e:
+            # Keys that don't match the query's key schema, e.g. a scan
+            # token replayed after the index was created
+            if not start_key or e.response['Error']['Code'] != 'ValidationException':
+                raise
+            return invalid_token_response()
         
         items = response.get('Items', [])
         
-        print(f"Retrieved {len(items)} images from DynamoDB")
-
-        # # Generate presigned URLs for each image
-        # for item in items:
-        #     if 's3Key' in item:
-        #         try:
-        #             presigned_url = s3.generate_presigned_url(
-        #                 'get_object',
-        #                 Params={
-        #                     'Bucket': BUCKET_NAME,
-        #                     'Key': item['s3Key']
-        #                 },
-        #                 ExpiresIn=3600  # 1 hour
-        #             )
-        #             item['downloadUrl'] = presigned_url
-        #         except Exception as url_error:
-        #             print(f"Error generating presigned URL for {item.get('imageId')}: {str(url_error)}")
-        #             item['downloadUrl'] = None
+        # Encode the last evaluated key so the client can request the next page
+        last_key = response.get('LastEvaluatedKey')
+        next_token = None
+        if last_key:
+            next_token = base64.urlsafe_b64encode(
+                json_dumps(last_key, default=decimal_default).encode()
+            ).decode('ascii')
         
-        # print(f"Retrieved {len(items)} images from DynamoDB with presigned URLs")
+        logger.debug("Retrieved %d images from DynamoDB", len(items))
+
+        # Add download URLs for each image
+        if params.get('includeUrls') in ('1', 'true'):
+            url_count = 0
+            for item in items:
+                if 's3Key' in item:
+                    item['downloadUrl'] = generate_download_url(item['s3Key'])
+                    url_count += 1
+            
+            logger.debug("Generated download URLs for %d images", url_count)
         
         return {
             'statusCode': 200,
@@ -65,21 +134,22 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': json_dumps({
                 'count': len(items),
-                'images': items
-            }, cls=DecimalEncoder)
+                'images': items,
+                'nextToken': next_token
+            }, default=decimal_default)
         }
         
     except Exception as e:
-        print(f"Error listing images: {str(e)}")
+        logger.error("Error listing images: %s", e)
         return {
             'statusCode': 500,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': json_dumps({
                 'error': 'Internal server error',
                 'message': str(e)
             })
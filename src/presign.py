@@ -0,0 +1,125 @@
+import boto3
+import hashlib
+import hmac
+import os
+import re
+import time
+from urllib.parse import quote, urlsplit
+
+# Shipped alongside each handler in its deployment zip
+
+_credentials = boto3.Session().get_credentials()
+
+# Bucket names that can be used as a DNS label over HTTPS. Dotted names
+# break the *.s3 wildcard certificate, so they are addressed path style
+_VIRTUAL_HOST_BUCKET_RE = re.compile(r'^[a-z0-9][a-z0-9-]{1,61}[a-z0-9]$')
+
+# Default regional/global S3 endpoints. Anything else (AWS_ENDPOINT_URL,
+# FIPS, dualstack, accelerate) is left to botocore's endpoint resolver
+_STANDARD_ENDPOINT_RE = re.compile(r'^s3(\.[a-z0-9-]+)?\.amazonaws\.com$')
+
+# Optional CloudFront domain in front of the bucket. When set, download URLs
+# are plain https://{CDN_DOMAIN}/{key} links with no signing; the distribution
+# must be able to read the bucket (origin access control) and serve the objects
+CDN_DOMAIN = os.environ.get('CDN_DOMAIN')
+
+URL_EXPIRES = 3600  # 1 hour
+URL_REFRESH_SKEW = 300  # re-sign once less than 5 minutes remain
+URL_CACHE_SIZE = 1024
+
+# (bucket, key) -> (presigned URL, expiry epoch); reused across warm invocations
+_URL_CACHE = {}
+
+# (datestamp, region, access key, derived SigV4 key); changes daily
+_signing_key = (None, None, None, None)
+
+def _hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+def get_signing_key(datestamp, region, creds):
+    """Derive the SigV4 signing key once per day, region and access key"""
+    global _signing_key
+    if _signing_key[:3] != (datestamp, region, creds.access_key):
+        k_date = _hmac_sha256(('AWS4' + creds.secret_key).encode('utf-8'), datestamp)
+        k_region = _hmac_sha256(k_date, region)
+        k_service = _hmac_sha256(k_region, 's3')
+        _signing_key = (datestamp, region, creds.access_key, _hmac_sha256(k_service, 'aws4_request'))
+    return _signing_key[3]
+
+def presign_get(s3, bucket, key, expires):
+    """
+    Build a SigV4 query-signed GetObject URL locally.
+    Same URL as s3.generate_presigned_url('get_object', ...) without the
+    botocore operation model, event hooks and endpoint resolution per call.
+    Non-standard endpoints fall back to botocore.
+    """
+    endpoint = urlsplit(s3.meta.endpoint_url)
+    if endpoint.scheme != 'https' or not _STANDARD_ENDPOINT_RE.match(endpoint.netloc):
+        return s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=expires
+        )
+    
+    region = s3.meta.region_name
+    creds = _credentials.get_frozen_credentials()
+    amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    datestamp = amz_date[:8]
+    scope = f"{datestamp}/{region}/s3/aws4_request"
+    
+    if _VIRTUAL_HOST_BUCKET_RE.match(bucket):
+        host = f"{bucket}.{endpoint.netloc}"
+        path = '/' + quote(key, safe='/~')
+    else:
+        host = endpoint.netloc
+        path = f"/{bucket}/" + quote(key, safe='/~')
+    
+    # Query parameters must be in sorted order for the canonical request
+    params = [
+        ('X-Amz-Algorithm', 'AWS4-HMAC-SHA256'),
+        ('X-Amz-Credential', f"{creds.access_key}/{scope}"),
+        ('X-Amz-Date', amz_date),
+        ('X-Amz-Expires', str(expires))
+    ]
+    if creds.token:
+        params.append(('X-Amz-Security-Token', creds.token))
+    params.append(('X-Amz-SignedHeaders', 'host'))
+    query = '&'.join(f"{name}={quote(value, safe='~')}" for name, value in params)
+    
+    canonical_request = f"GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    signature = hmac.new(
+        get_signing_key(datestamp, region, creds),
+        string_to_sign.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    
+    return f"https://{host}{path}?{query}&X-Amz-Signature={signature}"
+
+
+def get_download_url(s3, bucket, key):
+    """
+    Download URL for key: a CDN link if CDN_DOMAIN is set, otherwise a
+    presigned GET URL, reusing a cached one until close to expiry.
+    """
+    if CDN_DOMAIN:
+        return f"https://{CDN_DOMAIN}/" + quote(key, safe='/~')
+    
+    now = time.time()
+    hit = _URL_CACHE.get((bucket, key))
+    if hit and hit[1] - now > URL_REFRESH_SKEW:
+        return hit[0]
+    
+    url = presign_get(s3, bucket, key, URL_EXPIRES)
+    
+    _URL_CACHE.pop((bucket, key), None)
+    _URL_CACHE[(bucket, key)] = (url, now + URL_EXPIRES)
+    if len(_URL_CACHE) > URL_CACHE_SIZE:
+        del _URL_CACHE[next(iter(_URL_CACHE))]  # oldest entry
+    
+    return url
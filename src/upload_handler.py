@@ -1,95 +1,310 @@
-import json
 import boto3
-import base64
+try:
+    import pybase64 as base64  # SIMD-accelerated, same API as the stdlib module
+except ImportError:
+    import base64
+import io
+import logging
 import uuid
-from datetime import datetime
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from common import BOTO_CONFIG, json_dumps
+from presign import get_download_url
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+# No SHA-256 pass over upload bodies: S3 accepts UNSIGNED-PAYLOAD over
+# HTTPS, where TLS and the request checksum already cover integrity
+s3 = boto3.client('s3', config=BOTO_CONFIG.merge(Config(
+    signature_version='s3v4',
+    s3={'payload_signing_enabled': False}
+)))
+# Low-level client: the item is built as typed attribute values, skipping
+# the resource layer's per-call TypeSerializer pass
+dynamodb = boto3.client('dynamodb', config=BOTO_CONFIG)
+
+# Set LOG_LEVEL=DEBUG to log request/parse details
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 BUCKET_NAME = os.environ['BUCKET_NAME']
 TABLE_NAME = os.environ['TABLE_NAME']
 
+# Same headers on every response; built once per container
+RESPONSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+
+# Largest request body accepted; checked before any decoding work
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
+# Parts scanned for the file field before the body is given up on
+MAX_MULTIPART_PARTS = 32
+
+# Runs the S3 and DynamoDB writes of an upload side by side; kept warm
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Fresh ids to try if a conditional write finds the id or object key taken
+MAX_ID_ATTEMPTS = 3
+
+# Leading bytes of the accepted image formats and the content type they map to
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif')
+)
+
+# Files above 8 MB go up as parallel 8 MB multipart parts
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# Multipart patterns, compiled once; part headers are matched as bytes
+_BOUNDARY_RE = re.compile(r'boundary=(.+?)(?:;|$)')
+_FILENAME_QUOTED_RE = re.compile(rb'filename="([^"]+)"')
+_FILENAME_BARE_RE = re.compile(rb'filename=([^\s;]+)')
+_CONTENT_TYPE_RE = re.compile(rb'Content-Type:\s*([^\r\n]+)', re.IGNORECASE)
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file object over a memoryview, without copying it"""
+    
+    def __init__(self, buf):
+        self._buf = buf
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buf)
+        self._pos = max(0, offset)
+        return self._pos
+    
+    def read(self, size=-1):
+        end = len(self._buf) if size is None or size < 0 else self._pos + size
+        data = self._buf[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+    
+    def readinto(self, b):
+        chunk = self._buf[self._pos:self._pos + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
 def parse_multipart(body_bytes, content_type):
-    """Simple multipart parser that preserves binary data"""
+    """
+    Simple multipart parser that preserves binary data.
+    The file part is returned as a memoryview into body_bytes (no copy).
+    """
     # Extract boundary
-    match = re.search(r'boundary=(.+?)(?:;|$)', content_type)
+    match = _BOUNDARY_RE.search(content_type)
     if not match:
         return None, None, None
     
     boundary = match.group(1).strip('"').strip()
     boundary_bytes = b'--' + boundary.encode('utf-8')
     
-    # Split parts
-    parts = body_bytes.split(boundary_bytes)
+    boundary_len = len(boundary_bytes)
     
-    for part in parts:
-        if len(part) < 10:
+    # Walk the parts in place with find() instead of split(); only header
+    # blocks are copied, the file part is sliced out as a view
+    body_view = memoryview(body_bytes)
+    pos = body_bytes.find(boundary_bytes)
+    parts = 0
+    while pos != -1 and parts < MAX_MULTIPART_PARTS:
+        parts += 1
+        start = pos + boundary_len
+        end = body_bytes.find(boundary_bytes, start)
+        if end == -1:
+            end = len(body_bytes)
+            pos = -1
+        else:
+            pos = end
+        
+        if end - start < 10:
             continue
             
         # Find headers end
-        header_end = part.find(b'\r\n\r\n')
+        header_end = body_bytes.find(b'\r\n\r\n', start, end)
         if header_end == -1:
-            header_end = part.find(b'\n\n')
+            header_end = body_bytes.find(b'\n\n', start, end)
             if header_end == -1:
                 continue
             header_sep = b'\n\n'
         else:
             header_sep = b'\r\n\r\n'
         
-        headers = part[:header_end].decode('utf-8', errors='replace')
-        file_content = part[header_end + len(header_sep):]
+        headers = body_bytes[start:header_end]
         
         # Check if it's a file
-        if 'filename=' not in headers:
+        if b'filename=' not in headers:
             continue
         
         # Extract filename
-        fn_match = re.search(r'filename="([^"]+)"', headers)
-        if not fn_match:
-            fn_match = re.search(r'filename=([^\s;]+)', headers)
-        filename = fn_match.group(1) if fn_match else 'unknown'
+        fn_match = _FILENAME_QUOTED_RE.search(headers) or _FILENAME_BARE_RE.search(headers)
+        filename = fn_match.group(1).decode('utf-8', errors='replace') if fn_match else 'unknown'
         
         # Extract content type
-        ct_match = re.search(r'Content-Type:\s*([^\r\n]+)', headers, re.IGNORECASE)
-        file_content_type = ct_match.group(1).strip() if ct_match else 'application/octet-stream'
+        ct_match = _CONTENT_TYPE_RE.search(headers)
+        if ct_match:
+            file_content_type = ct_match.group(1).strip().decode('utf-8', errors='replace')
+        else:
+            file_content_type = 'application/octet-stream'
         
-        # Clean trailing boundary/CRLF
-        if file_content.endswith(b'\r\n'):
-            file_content = file_content[:-2]
-        if file_content.endswith(b'\n'):
-            file_content = file_content[:-1]
-        if file_content.endswith(b'--'):
-            file_content = file_content[:-2]
-        if file_content.endswith(b'\r\n'):
-            file_content = file_content[:-2]
+        # The line break before the next boundary belongs to the boundary
+        # (RFC 2046), so the part ends exactly there; bare LF for lax clients
+        content_start = header_end + len(header_sep)
+        if body_bytes.endswith(b'\r\n', content_start, end):
+            end -= 2
+        elif body_bytes.endswith(b'\n', content_start, end):
+            end -= 1
         
-        return file_content, filename, file_content_type
+        return body_view[content_start:end], filename, file_content_type
     
     return None, None, None
 
 
+def sniff_image_type(file_data):
+    """Content type from the file's JPEG/PNG/GIF/WebP magic bytes, or None"""
+    head = bytes(file_data[:12])
+    for signature, image_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def is_id_taken(error):
+    """True if a conditional write failed because the image id or its object key is in use"""
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in (
+        'ConditionalCheckFailedException',  # DynamoDB: imageId exists
+        'PreconditionFailed',               # S3 If-None-Match: object exists
+        'ConditionalRequestConflict'        # S3: concurrent conditional write to the key
+    )
+
+
+def put_metadata(item):
+    """Write the metadata row; never replaces an existing imageId"""
+    return dynamodb.put_item(
+        TableName=TABLE_NAME,
+        Item=item,
+        ConditionExpression='attribute_not_exists(imageId)'
+    )
+
+
+def delete_metadata(item):
+    dynamodb.delete_item(TableName=TABLE_NAME, Key={'imageId': item['imageId']})
+
+
+def store_upload(s3_key, file_data, file_content_type, item, include_url=False):
+    """
+    Write the object to S3 and its metadata to DynamoDB concurrently.
+    Neither write replaces an existing object or imageId, so whichever one
+    succeeded is rolled back if the other fails, and the error re-raised.
+    item is in DynamoDB attribute-value form.
+    Returns the download URL if include_url is set, else None.
+    """
+    if len(file_data) > TRANSFER_CONFIG.multipart_threshold:
+        return store_multipart_upload(s3_key, file_data, file_content_type, item, include_url)
+    
+    s3_future = _EXECUTOR.submit(
+        s3.put_object,
+        Bucket=BUCKET_NAME,
+        Key=s3_key,
+        Body=BufferReader(file_data),
+        ContentType=file_content_type,
+        IfNoneMatch='*'
+    )
+    ddb_future = _EXECUTOR.submit(put_metadata, item)
+    
+    # Signing is local, so it overlaps with the two network round-trips
+    try:
+        download_url = get_download_url(s3, BUCKET_NAME, s3_key) if include_url else None
+    finally:
+        wait((s3_future, ddb_future))
+    
+    s3_error = s3_future.exception()
+    ddb_error = ddb_future.exception()
+    if not s3_error and not ddb_error:
+        return download_url
+    
+    try:
+        if not s3_error:
+            s3.delete_object(Bucket=BUCKET_NAME, Key=s3_key)
+        if not ddb_error:
+            delete_metadata(item)
+    except Exception as rollback_error:
+        logger.error("Error rolling back upload %s: %s", s3_key, rollback_error)
+    
+    raise s3_error or ddb_error
+
+
+def store_multipart_upload(s3_key, file_data, file_content_type, item, include_url=False):
+    """
+    upload_fileobj cannot send If-None-Match, so for multipart-sized files
+    the conditional metadata write reserves the id before the object is
+    written, and is rolled back if the upload fails.
+    """
+    put_metadata(item)
+    try:
+        s3.upload_fileobj(
+            BufferReader(file_data),
+            BUCKET_NAME,
+            s3_key,
+            ExtraArgs={'ContentType': file_content_type},
+            Config=TRANSFER_CONFIG
+        )
+    except Exception:
+        try:
+            delete_metadata(item)
+        except Exception as rollback_error:
+            logger.error("Error rolling back upload %s: %s", s3_key, rollback_error)
+        raise
+    
+    return get_download_url(s3, BUCKET_NAME, s3_key) if include_url else None
+
+
 def lambda_handler(event, context):
     """
     POST /upload
     Upload file to S3 and store metadata in DynamoDB
+    
+    Optional query parameters:
+    - includeUrl: Set to 1/true to return a downloadUrl
     """
     try:
-        content_type = event.get('headers', {}).get('content-type', '') or \
-                       event.get('headers', {}).get('Content-Type', '')
+        # API Gateway v1 keeps the client's header casing, v2 lowercases it
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        content_type = headers.get('content-type', '')
         
         if 'multipart/form-data' not in content_type:
             return response(400, {'error': 'Content-Type must be multipart/form-data'})
         
         # Get body bytes - MUST be base64 encoded for binary files
-        body = event.get('body', '')
+        body = event.get('body') or ''
         is_base64 = event.get('isBase64Encoded', False)
         
-        # Debug info
-        print(f"isBase64Encoded: {is_base64}")
-        print(f"Body type: {type(body)}, length: {len(body)}")
+        logger.debug("isBase64Encoded: %s, body length: %d", is_base64, len(body))
         
         if not is_base64:
             # API Gateway không được cấu hình Binary Media Types!
@@ -99,8 +314,14 @@ def lambda_handler(event, context):
                 'isBase64Encoded': is_base64
             })
         
+        # Reject oversized bodies before any decoding; base64 decodes to 3/4 of its length
+        content_length = headers.get('content-length', '')
+        declared = int(content_length) if content_length.isdigit() else 0
+        if max(declared, (len(body) * 3) // 4) > MAX_UPLOAD_BYTES:
+            return response(413, {'error': 'Payload too large', 'maxBytes': MAX_UPLOAD_BYTES})
+        
         body_bytes = base64.b64decode(body)
-        print(f"Decoded body length: {len(body_bytes)}")
+        logger.debug("Decoded body length: %d", len(body_bytes))
         
         # Parse multipart
         file_data, filename, file_content_type = parse_multipart(body_bytes, content_type)
@@ -108,63 +329,75 @@ def lambda_handler(event, context):
         if not file_data or not filename:
             return response(400, {'error': 'No file found in request'})
         
-        print(f"File: {filename}, Size: {len(file_data)}, Type: {file_content_type}")
+        logger.debug("File: %s, Size: %d, Type: %s", filename, len(file_data), file_content_type)
+        
+        # Reject non-images before anything is written to S3. Parts sent
+        # untyped arrive as octet-stream; the stored type always comes from
+        # the magic bytes, never from the client's label or the filename
+        image_type = sniff_image_type(file_data)
+        declared_ok = file_content_type.startswith('image/') or file_content_type == 'application/octet-stream'
+        if not image_type or not declared_ok:
+            return response(415, {
+                'error': 'Unsupported media type',
+                'message': 'Only JPEG, PNG, GIF and WebP images are accepted'
+            })
+        file_content_type = image_type
         
-        # Generate ID and key
-        image_id = str(uuid.uuid4())
         ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'bin'
-        s3_key = f"images/{image_id}.{ext}"
-        
-        # Upload to S3
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=s3_key,
-            Body=file_data,
-            ContentType=file_content_type
-        )
         
-        # Save metadata to DynamoDB
-        table = dynamodb.Table(TABLE_NAME)
-        timestamp = datetime.utcnow().isoformat()
+        # Download URL only on request; GET /images/{id} returns one as well
+        params = event.get('queryStringParameters') or {}
+        include_url = params.get('includeUrl') in ('1', 'true')
         
-        table.put_item(Item={
-            'imageId': image_id,
-            'filename': filename,
-            'contentType': file_content_type,
-            's3Key': s3_key,
-            'size': len(file_data),
-            'uploadedAt': timestamp,
-            'bucket': BUCKET_NAME
-        })
-        
-        # Generate download URL
-        download_url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': BUCKET_NAME, 'Key': s3_key},
-            ExpiresIn=3600
-        )
+        timestamp = time.time_ns() // 1_000_000  # epoch milliseconds
+        
+        for attempt in range(MAX_ID_ATTEMPTS):
+            # Generate ID and key
+            image_id = uuid.uuid4().hex
+            s3_key = f"images/{image_id}.{ext}"
+            
+            # Upload to S3 and save metadata to DynamoDB, never overwriting either
+            try:
+                download_url = store_upload(s3_key, file_data, file_content_type, {
+                    'imageId': {'S': image_id},
+                    'type': {'S': 'image'},  # partition key of type-uploadedAt-index
+                    'filename': {'S': filename},
+                    'contentType': {'S': file_content_type},
+                    's3Key': {'S': s3_key},
+                    'size': {'N': str(len(file_data))},
+                    'uploadedAt': {'N': str(timestamp)},
+                    'bucket': {'S': BUCKET_NAME}
+                }, include_url)
+                break
+            except ClientError as e:
+                if not is_id_taken(e) or attempt == MAX_ID_ATTEMPTS - 1:
+                    raise
+                logger.warning("Image id %s already exists, retrying with a new id", image_id)
         
-        return response(201, {
+        result = {
             'message': 'Upload successful',
             'imageId': image_id,
             'filename': filename,
             's3Key': s3_key,
-            'downloadUrl': download_url,
             'size': len(file_data),
             'contentType': file_content_type
-        })
+        }
+        
+        if download_url:
+            result['downloadUrl'] = download_url
+        
+        logger.info("Uploaded %s (%d bytes) as %s", filename, len(file_data), s3_key)
+        
+        return response(201, result)
         
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.error("Error: %s", e)
         return response(500, {'error': 'Internal server error', 'message': str(e)})
 
 
 def response(status_code, body):
     return {
         'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(body)
+        'headers': RESPONSE_HEADERS,
+        'body': json_dumps(body)
     }
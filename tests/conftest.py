@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Handlers read their configuration and create boto3 clients at import
+# time, so the environment has to be in place before any test module loads
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'AKIDEXAMPLE')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY')
+os.environ.setdefault('AWS_SESSION_TOKEN', 'session/token+with=reserved')
+os.environ.setdefault('BUCKET_NAME', 'img-bucket')
+os.environ.setdefault('TABLE_NAME', 'images')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -0,0 +1,71 @@
+import base64
+import json
+from unittest import mock
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+import list_handler
+
+
+def _token(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode('ascii')
+
+
+def _validation_error(message, operation='Query'):
+    return ClientError({'Error': {'Code': 'ValidationException', 'Message': message}}, operation)
+
+
+@pytest.fixture
+def table():
+    with mock.patch.object(list_handler, '_table') as table:
+        yield table
+
+
+def test_next_token_round_trips_last_evaluated_key(table):
+    last_key = {'imageId': 'abc', 'type': 'image', 'uploadedAt': 1700000000000}
+    table.query.return_value = {'Items': [{'imageId': 'abc'}], 'LastEvaluatedKey': last_key}
+
+    first = list_handler.lambda_handler({'queryStringParameters': None}, None)
+    token = json.loads(first['body'])['nextToken']
+    list_handler.lambda_handler({'queryStringParameters': {'nextToken': token}}, None)
+
+    assert table.query.call_args.kwargs['ExclusiveStartKey'] == last_key
+
+
+@pytest.mark.parametrize('token', ['!!', _token([1]), _token({})])
+def test_undecodable_next_token_is_rejected(table, token):
+    result = list_handler.lambda_handler({'queryStringParameters': {'nextToken': token}}, None)
+
+    assert result['statusCode'] == 400
+    table.query.assert_not_called()
+
+
+def test_next_token_with_wrong_keys_is_rejected(table):
+    table.query.side_effect = _validation_error('The provided starting key is invalid')
+
+    result = list_handler.lambda_handler({'queryStringParameters': {'nextToken': _token({'a': 1})}}, None)
+
+    assert result['statusCode'] == 400
+    assert json.loads(result['body']) == {'error': 'Invalid nextToken'}
+
+
+def test_next_token_rejected_by_scan_fallback(table):
+    table.query.side_effect = _validation_error('The table does not have the specified index: type-uploadedAt-index')
+    table.scan.side_effect = _validation_error('The provided starting key is invalid', 'Scan')
+
+    result = list_handler.lambda_handler(
+        {'queryStringParameters': {'nextToken': _token({'imageId': 'abc', 'type': 'image', 'uploadedAt': 1})}},
+        None
+    )
+
+    assert result['statusCode'] == 400
+
+
+def test_validation_error_without_token_is_a_server_error(table):
+    table.query.side_effect = _validation_error('Limit must be greater than 0')
+
+    result = list_handler.lambda_handler({'queryStringParameters': {'limit': '0'}}, None)
+
+    assert result['statusCode'] == 500
@@ -0,0 +1,94 @@
+import datetime
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+import boto3
+from botocore.config import Config
+
+import presign
+
+FIXED_NOW = datetime.datetime(2026, 10, 14, 12, 34, 56)
+
+
+def _split(url):
+    parts = urlsplit(url)
+    return parts.netloc, parts.path, sorted(parse_qsl(parts.query))
+
+
+@pytest.mark.parametrize('region', ['us-east-1', 'ap-southeast-1'])
+@pytest.mark.parametrize('bucket, addressing_style', [
+    ('my-bucket', 'virtual'),
+    ('my.dotted.bucket', 'path')
+])
+@pytest.mark.parametrize('key', ['images/abc.jpg', 'images/we ird+ü~(1).png'])
+def test_presign_get_matches_botocore(region, bucket, addressing_style, key):
+    s3 = boto3.client('s3', region_name=region)
+    reference = boto3.client('s3', region_name=region, config=Config(
+        signature_version='s3v4',
+        s3={'addressing_style': addressing_style}
+    ))
+
+    with mock.patch.object(presign.time, 'gmtime', return_value=FIXED_NOW.timetuple()):
+        ours = presign.presign_get(s3, bucket, key, 3600)
+    with mock.patch('botocore.auth.get_current_datetime', return_value=FIXED_NOW):
+        expected = reference.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=3600
+        )
+
+    assert _split(ours) == _split(expected)
+
+
+def test_presign_get_defers_custom_endpoint_to_botocore():
+    s3 = boto3.client('s3', region_name='us-east-1', endpoint_url='http://localhost:4566')
+
+    with mock.patch.object(s3, 'generate_presigned_url', return_value='signed') as generate:
+        assert presign.presign_get(s3, 'my-bucket', 'images/abc.jpg', 3600) == 'signed'
+
+    generate.assert_called_once_with(
+        'get_object',
+        Params={'Bucket': 'my-bucket', 'Key': 'images/abc.jpg'},
+        ExpiresIn=3600
+    )
+
+
+def test_get_download_url_reuses_url_until_refresh_skew():
+    s3 = boto3.client('s3', region_name='us-east-1')
+    presign._URL_CACHE.clear()
+
+    with mock.patch.object(presign, 'presign_get', side_effect=['first', 'second']) as sign:
+        with mock.patch.object(presign.time, 'time', return_value=1000.0):
+            assert presign.get_download_url(s3, 'my-bucket', 'images/a.jpg') == 'first'
+        refresh_at = 1000.0 + presign.URL_EXPIRES - presign.URL_REFRESH_SKEW
+        with mock.patch.object(presign.time, 'time', return_value=refresh_at - 1):
+            assert presign.get_download_url(s3, 'my-bucket', 'images/a.jpg') == 'first'
+        with mock.patch.object(presign.time, 'time', return_value=refresh_at):
+            assert presign.get_download_url(s3, 'my-bucket', 'images/a.jpg') == 'second'
+
+    assert sign.call_count == 2
+
+
+def test_get_download_url_evicts_oldest_entry():
+    s3 = boto3.client('s3', region_name='us-east-1')
+    presign._URL_CACHE.clear()
+
+    with mock.patch.object(presign, 'presign_get', side_effect=lambda s3, bucket, key, expires: key):
+        for i in range(presign.URL_CACHE_SIZE + 1):
+            presign.get_download_url(s3, 'my-bucket', f"images/{i}.jpg")
+
+    assert len(presign._URL_CACHE) == presign.URL_CACHE_SIZE
+    assert ('my-bucket', 'images/0.jpg') not in presign._URL_CACHE
+
+
+def test_get_download_url_uses_cdn_domain_without_signing():
+    s3 = boto3.client('s3', region_name='us-east-1')
+
+    with mock.patch.object(presign, 'CDN_DOMAIN', 'd111.cloudfront.net'), \
+            mock.patch.object(presign, 'presign_get') as sign:
+        url = presign.get_download_url(s3, 'my-bucket', 'images/we ird.png')
+
+    assert url == 'https://d111.cloudfront.net/images/we%20ird.png'
+    sign.assert_not_called()
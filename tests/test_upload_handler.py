@@ -0,0 +1,267 @@
+import base64
+import io
+from unittest import mock
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+import upload_handler
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256))
+CONTENT_TYPE = 'multipart/form-data; boundary=XyZ'
+
+
+def _field(name, value, newline=b'\r\n'):
+    return (
+        b'--XyZ' + newline
+        + b'Content-Disposition: form-data; name="' + name + b'"' + newline + newline
+        + value + newline
+    )
+
+
+def _file(data, filename=b'cat.png', content_type=b'image/png', newline=b'\r\n'):
+    headers = b'Content-Disposition: form-data; name="file"; filename="' + filename + b'"' + newline
+    if content_type:
+        headers += b'Content-Type: ' + content_type + newline
+    return b'--XyZ' + newline + headers + newline + data + newline
+
+
+def _close(newline=b'\r\n'):
+    return b'--XyZ--' + newline
+
+
+def test_parse_multipart_crlf_after_non_file_part():
+    body = _field(b'note', b'hello') + _file(PNG) + _close()
+
+    data, filename, content_type = upload_handler.parse_multipart(body, CONTENT_TYPE)
+
+    assert bytes(data) == PNG
+    assert filename == 'cat.png'
+    assert content_type == 'image/png'
+
+
+def test_parse_multipart_returns_view_into_body():
+    body = _file(PNG) + _close()
+
+    data, _, _ = upload_handler.parse_multipart(body, CONTENT_TYPE)
+
+    assert isinstance(data, memoryview)
+    assert data.obj is body
+
+
+def test_parse_multipart_bare_lf():
+    body = _field(b'note', b'hello', b'\n') + _file(PNG, b'a.gif', None, b'\n') + _close(b'\n')
+
+    data, filename, content_type = upload_handler.parse_multipart(body, CONTENT_TYPE)
+
+    assert bytes(data) == PNG
+    assert filename == 'a.gif'
+    assert content_type == 'application/octet-stream'
+
+
+def test_parse_multipart_unquoted_filename_and_quoted_boundary():
+    body = (
+        b'--XyZ\r\nContent-Disposition: form-data; name=file; filename=a.png\r\n\r\n'
+        + PNG + b'\r\n' + _close()
+    )
+
+    data, filename, _ = upload_handler.parse_multipart(body, 'multipart/form-data; boundary="XyZ"')
+
+    assert bytes(data) == PNG
+    assert filename == 'a.png'
+
+
+@pytest.mark.parametrize('tail', [b'--', b'\n', b'\r\n', b'--\r\n'])
+def test_parse_multipart_keeps_trailing_file_bytes(tail):
+    body = _file(PNG + tail) + _close()
+
+    data, _, _ = upload_handler.parse_multipart(body, CONTENT_TYPE)
+
+    assert bytes(data) == PNG + tail
+
+
+def test_parse_multipart_without_file_part():
+    body = _field(b'note', b'hello') + _close()
+
+    assert upload_handler.parse_multipart(body, CONTENT_TYPE) == (None, None, None)
+
+
+def test_parse_multipart_without_boundary():
+    assert upload_handler.parse_multipart(_file(PNG), 'multipart/form-data') == (None, None, None)
+
+
+def test_parse_multipart_stops_after_max_parts():
+    fields = [_field(b'f%d' % i, b'value') for i in range(upload_handler.MAX_MULTIPART_PARTS)]
+
+    within = b''.join(fields[:-1]) + _file(PNG) + _close()
+    beyond = b''.join(fields) + _file(PNG) + _close()
+
+    assert bytes(upload_handler.parse_multipart(within, CONTENT_TYPE)[0]) == PNG
+    assert upload_handler.parse_multipart(beyond, CONTENT_TYPE) == (None, None, None)
+
+
+def test_buffer_reader_read_and_seek():
+    reader = upload_handler.BufferReader(memoryview(b'0123456789'))
+
+    assert reader.read(4) == b'0123'
+    assert reader.tell() == 4
+    assert reader.read() == b'456789'
+    assert reader.read(1) == b''
+
+    assert reader.seek(2) == 2
+    assert reader.seek(3, io.SEEK_CUR) == 5
+    assert reader.read(2) == b'56'
+    assert reader.seek(-3, io.SEEK_END) == 7
+    assert reader.read(None) == b'789'
+    assert reader.seek(-100, io.SEEK_CUR) == 0
+
+
+def test_buffer_reader_readinto():
+    reader = upload_handler.BufferReader(memoryview(b'0123456789'))
+    buf = bytearray(4)
+
+    assert reader.readinto(buf) == 4
+    assert buf == b'0123'
+
+    reader.seek(8)
+    assert reader.readinto(buf) == 2
+    assert buf[:2] == b'89'
+    assert reader.readinto(buf) == 0
+
+
+def _client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+def _item(image_id='abc'):
+    return {'imageId': {'S': image_id}, 's3Key': {'S': f"images/{image_id}.png"}}
+
+
+def _upload_event(data=PNG):
+    body = _file(data) + _close()
+    return {
+        'headers': {'Content-Type': CONTENT_TYPE},
+        'isBase64Encoded': True,
+        'body': base64.b64encode(body).decode('ascii')
+    }
+
+
+@pytest.fixture
+def clients():
+    with mock.patch.object(upload_handler, 's3') as s3, \
+            mock.patch.object(upload_handler, 'dynamodb') as dynamodb:
+        yield s3, dynamodb
+
+
+def test_store_upload_writes_both_sides_conditionally(clients):
+    s3, dynamodb = clients
+
+    upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    assert s3.put_object.call_args.kwargs['IfNoneMatch'] == '*'
+    assert dynamodb.put_item.call_args.kwargs['ConditionExpression'] == 'attribute_not_exists(imageId)'
+    s3.delete_object.assert_not_called()
+    dynamodb.delete_item.assert_not_called()
+
+
+def test_store_upload_s3_failure_deletes_row(clients):
+    s3, dynamodb = clients
+    s3.put_object.side_effect = _client_error('InternalError', 'PutObject')
+
+    with pytest.raises(ClientError):
+        upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    dynamodb.delete_item.assert_called_once_with(TableName=upload_handler.TABLE_NAME, Key={'imageId': {'S': 'abc'}})
+    s3.delete_object.assert_not_called()
+
+
+def test_store_upload_dynamodb_failure_deletes_object(clients):
+    s3, dynamodb = clients
+    dynamodb.put_item.side_effect = _client_error('ProvisionedThroughputExceededException', 'PutItem')
+
+    with pytest.raises(ClientError):
+        upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    s3.delete_object.assert_called_once_with(Bucket=upload_handler.BUCKET_NAME, Key='images/abc.png')
+    dynamodb.delete_item.assert_not_called()
+
+
+def test_store_upload_raises_original_error_when_rollback_fails(clients):
+    s3, dynamodb = clients
+    dynamodb.put_item.side_effect = _client_error('InternalServerError', 'PutItem')
+    s3.delete_object.side_effect = _client_error('AccessDenied', 'DeleteObject')
+
+    with pytest.raises(ClientError) as raised:
+        upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    assert raised.value.response['Error']['Code'] == 'InternalServerError'
+
+
+def test_store_upload_multipart_reserves_id_first(clients):
+    s3, dynamodb = clients
+    calls = []
+    dynamodb.put_item.side_effect = lambda **kwargs: calls.append('put_item')
+    s3.upload_fileobj.side_effect = lambda *args, **kwargs: calls.append('upload_fileobj')
+
+    with mock.patch.object(upload_handler.TRANSFER_CONFIG, 'multipart_threshold', 4):
+        upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    assert calls == ['put_item', 'upload_fileobj']
+    s3.put_object.assert_not_called()
+
+
+def test_store_upload_multipart_failure_deletes_row(clients):
+    s3, dynamodb = clients
+    s3.upload_fileobj.side_effect = _client_error('InternalError', 'UploadPart')
+
+    with mock.patch.object(upload_handler.TRANSFER_CONFIG, 'multipart_threshold', 4), \
+            pytest.raises(ClientError):
+        upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    dynamodb.delete_item.assert_called_once()
+
+
+def test_store_upload_multipart_collision_writes_no_object(clients):
+    s3, dynamodb = clients
+    dynamodb.put_item.side_effect = _client_error('ConditionalCheckFailedException', 'PutItem')
+
+    with mock.patch.object(upload_handler.TRANSFER_CONFIG, 'multipart_threshold', 4), \
+            pytest.raises(ClientError):
+        upload_handler.store_upload('images/abc.png', memoryview(PNG), 'image/png', _item())
+
+    s3.upload_fileobj.assert_not_called()
+    dynamodb.delete_item.assert_not_called()
+
+
+@pytest.mark.parametrize('taken_side', ['dynamodb', 's3'])
+def test_upload_retries_with_new_id_on_collision(clients, taken_side):
+    s3, dynamodb = clients
+    if taken_side == 'dynamodb':
+        dynamodb.put_item.side_effect = [_client_error('ConditionalCheckFailedException', 'PutItem'), {}]
+    else:
+        s3.put_object.side_effect = [_client_error('PreconditionFailed', 'PutObject'), {}]
+
+    result = upload_handler.lambda_handler(_upload_event(), None)
+
+    assert result['statusCode'] == 201
+    first, second = (call.kwargs['Item']['imageId']['S'] for call in dynamodb.put_item.call_args_list)
+    assert first != second
+    # The write that succeeded on the taken id was ours and is undone
+    if taken_side == 'dynamodb':
+        s3.delete_object.assert_called_once_with(Bucket=upload_handler.BUCKET_NAME, Key=f"images/{first}.png")
+        dynamodb.delete_item.assert_not_called()
+    else:
+        dynamodb.delete_item.assert_called_once_with(TableName=upload_handler.TABLE_NAME, Key={'imageId': {'S': first}})
+        s3.delete_object.assert_not_called()
+
+
+def test_upload_fails_after_max_id_attempts(clients):
+    s3, dynamodb = clients
+    dynamodb.put_item.side_effect = _client_error('ConditionalCheckFailedException', 'PutItem')
+
+    result = upload_handler.lambda_handler(_upload_event(), None)
+
+    assert result['statusCode'] == 500
+    assert dynamodb.put_item.call_count == upload_handler.MAX_ID_ATTEMPTS
+    assert s3.delete_object.call_count == upload_handler.MAX_ID_ATTEMPTS